@@ -1,23 +1,34 @@
-import io
-import json
+import asyncio
 import calendar
+import contextvars
+import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
+from typing import Optional
 
 from app.utils.capabilities import CAPABILITIES
-from app.utils.cache import getCacheUrl
+from app.utils.cache import hot_get, hot_put, layer_url_key
 import ee
 import aiohttp
-from fastapi import APIRouter, HTTPException, Request, Query
-from fastapi.responses import StreamingResponse, FileResponse
+import orjson
+from cachetools import TTLCache
+from PIL import Image
+from valkey.exceptions import ConnectionError as ValkeyConnectionError
+from valkey.exceptions import TimeoutError as ValkeyTimeoutError
+from fastapi import APIRouter, HTTPException, Request, Response, Query
 
 
 from app.config import logger, settings
-from app.tile import tile2goehashBBOX
+from app.tile import MAXMIN_ZOOM_PNG, is_within_brazil, tile2goehashBBOX, zoom_in_range
 from app.visParam import VISPARAMS
 from app.visParam import get_landsat_vis_params
-from app.errors import generate_error_image
+from app.errors import error_image_bytes
 router = APIRouter()
 
 
@@ -27,13 +38,426 @@ class Period(str, Enum):
     MONTH = "MONTH"
 
 
-async def fetch_image_from_api(image_url: str):
+_BLANK_PNG = Path("data/blank.png").read_bytes()
+_NOTFOUND_PNG = Path("data/notfound.png").read_bytes()
+
+
+def _static_png(content: bytes, cache_control: str = "public, max-age=86400") -> Response:
+    return Response(
+        content=content,
+        media_type="image/png",
+        headers={"Cache-Control": cache_control},
+    )
+
+
+_CAPS_BY_NAME = {
+    c["name"]: {
+        **c,
+        "years": frozenset(c["year"]),
+        "periods": frozenset(c["period"]),
+        "visparams": frozenset(c["visparam"]),
+    }
+    for c in CAPABILITIES["collections"]
+}
+
+_PERIOD_TEMPLATES = {
+    "WET": ("01-01", "04-30"),
+    "DRY": ("06-01", "10-30"),
+}
+
+
+@lru_cache(maxsize=4096)
+def _check_capability(name: str, year: int, period: str, visparam: str):
+    """Valida os parâmetros da camada, retorna (ok, detail)."""
+    metadata = _CAPS_BY_NAME.get(name)
+    if metadata is None:
+        return False, f'{name} capabilities not found.'
+    if year not in metadata['years']:
+        return False, f'Invalid year, please try valid year {metadata["year"]}'
+    if period not in metadata['periods']:
+        return False, f'Invalid period, please try valid period {metadata["period"]}'
+    if visparam not in metadata['visparams']:
+        return False, f'Invalid visparam, please try valid visparam {metadata["visparam"]}'
+    return True, None
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    return value
+
+
+@lru_cache(maxsize=4096)
+def _build_periods(period: str, year: int, month: int):
+    """Monta o intervalo de datas do período, ou None se o período não existir."""
+    if period == "MONTH":
+        _, last_day = calendar.monthrange(year, month)
+        return MappingProxyType({
+            "name": "MONTH",
+            "dtStart": f"{year}-{month:02}-01",
+            "dtEnd": f"{year}-{month:02}-{last_day:02}"
+        })
+    template = _PERIOD_TEMPLATES.get(period)
+    if template is None:
+        return None
+    start, end = template
+    return MappingProxyType({"name": period, "dtStart": f"{year}-{start}", "dtEnd": f"{year}-{end}"})
+
+
+@lru_cache(maxsize=4096)
+def _vis_param(visparam: str):
+    # Somente leitura: o mesmo objeto é devolvido a todas as requisições
+    return _freeze(VISPARAMS.get(visparam))
+
+
+@lru_cache(maxsize=1024)
+def _url_template(layer_url: str) -> str:
+    """Converte o template do EE ({x}/{y}/{z}) para formatação com %."""
+    return (
+        layer_url.replace('%', '%%')
+        .replace('{x}', '%(x)s')
+        .replace('{y}', '%(y)s')
+        .replace('{z}', '%(z)s')
+    )
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Comparação fraca (RFC 9110): aceita lista, W/ e '*'."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def _tile_response(request: Request, content: bytes, media_type: str = "image/png") -> Response:
+    """Responde o tile com ETag/Cache-Control, ou 304 se o cliente já o tem."""
+    etag = f'"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+    headers = {
+        "Cache-Control": f"public, max-age={int(settings.LIFESPAN_URL * 3600)}, immutable",
+        "ETag": etag,
+        "Vary": "Accept",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+def _png_to_webp(png: bytes) -> bytes:
+    # Sem perdas: os valores dos pixels continuam iguais aos do PNG do EE
+    with Image.open(io.BytesIO(png)) as image:
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", lossless=True, method=4)
+    return buffer.getvalue()
+
+
+# Pool próprio, separado do _ee_pool e do executor padrão
+_webp_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webp")
+
+
+# Conversões agendadas e ainda não concluídas, limitadas por WEBP_MAX_PENDING
+_webp_pending = 0
+
+
+def _webp_done(_):
+    global _webp_pending
+    _webp_pending -= 1
+
+
+async def _encode_webp(valkey, webp_cache, png):
+    try:
+        webp = await asyncio.get_running_loop().run_in_executor(_webp_pool, _png_to_webp, png)
+    except Exception as e:
+        _log_failure(e, '{} | {}', webp_cache, e)
+        return
+    hot_put(webp_cache, webp)
+    await valkey.set(webp_cache, webp)
+
+
+async def _serve_tile(request: Request, file_cache: str, png: bytes, fresh: bool = False) -> Response:
+    """Entrega o tile em WebP quando o cliente aceita e já há versão pronta, senão em PNG.
+
+    fresh indica que o PNG acabou de ser baixado, então não há WebP para buscar.
+    """
+    global _webp_pending
+    if "image/webp" not in request.headers.get("accept", ""):
+        return _tile_response(request, png)
+
+    webp_cache = f"{file_cache}.webp"
+    webp = hot_get(webp_cache)
+    if webp is None and not fresh:
+        try:
+            webp = await request.app.state.valkey.get(webp_cache)
+        except _VALKEY_ERRORS as e:
+            _log_failure(e, '{} | {}', webp_cache, e)
+    if webp is None:
+        # A conversão não atrasa a resposta: este cliente recebe o PNG
+        # e os próximos já encontram o WebP no cache. Com a fila cheia,
+        # a conversão fica para uma próxima requisição do tile.
+        # Teste e registro sem await no meio: requisições que retomam na
+        # mesma volta do loop veem a conversão já em _inflight
+        if webp_cache not in _inflight and _webp_pending < settings.WEBP_MAX_PENDING:
+            _webp_pending += 1
+            task = _start_flight(webp_cache, _encode_webp, request.app.state.valkey, webp_cache, png)
+            task.add_done_callback(_webp_done)
+            _watch_background(task)
+        return _tile_response(request, png)
+    hot_put(webp_cache, webp)
+    return _tile_response(request, webp, media_type="image/webp")
+
+
+def _error_response(detail: str) -> Response:
+    """Responde com a imagem de erro renderizada (e cacheada) para a mensagem."""
+    header = ' '.join(detail.split())[:200].encode('ascii', 'replace').decode()
+    return Response(
+        content=error_image_bytes(detail),
+        media_type="image/png",
+        headers={"X-Error": header},
+    )
+
+
+# Por tipo de exceção: [tokens, último instante, mensagens suprimidas]
+_log_buckets: dict[type, list] = {}
+
+
+def _log_failure(exc: BaseException, message: str, *args):
+    """logger.exception limitado a ERROR_LOG_RATE por segundo para cada tipo de erro."""
+    rate = settings.ERROR_LOG_RATE
+    now = time.monotonic()
+    bucket = _log_buckets.setdefault(type(exc), [rate, now, 0])
+    tokens = min(rate, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        bucket[2] += 1
+        return
+    bucket[0] = tokens - 1
+    suppressed, bucket[2] = bucket[2], 0
+    if suppressed:
+        message += ' ({} similar errors suppressed)'
+        args = (*args, suppressed)
+    logger.opt(exception=exc).error(message, *args)
+
+
+_bg_tasks: set[asyncio.Task] = set()
+
+
+def _write_in_background(coro):
+    """Executa uma escrita no cache fora do caminho crítico da resposta."""
+    _watch_background(asyncio.create_task(coro))
+
+
+def _watch_background(task: asyncio.Task):
+    _bg_tasks.add(task)
+    task.add_done_callback(_background_done)
+
+
+def _background_done(task: asyncio.Task):
+    _bg_tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        _log_failure(exc, 'Background cache write failed: {}', exc)
+
+
+@lru_cache(maxsize=1024)
+def _s2_collection(dt_start, dt_end, w, s, e, n):
+    """Coleção Sentinel-2 filtrada e ordenada, comum a todos os visparams."""
+    geom = ee.Geometry.BBox(w, s, e, n)
+    s2 = ee.ImageCollection("COPERNICUS/S2_HARMONIZED")
+    s2 = s2.filterDate(dt_start, dt_end).filterBounds(geom)
+    return s2.sort("CLOUDY_PIXEL_PERCENTAGE", False)
+
+
+def _create_s2_layer_sync(bbox, dates, vis):
+    """Monta o mosaico Sentinel-2 no EE e retorna o template de URL dos tiles."""
+    s2 = _s2_collection(
+        dates["dtStart"], dates["dtEnd"], bbox["w"], bbox["s"], bbox["e"], bbox["n"]
+    )
+    s2 = s2.select(*vis["select"])
+    best_image = s2.mosaic()
+
+    logger.debug('{} | {}', vis["select"], vis["visparam"])
+
+    map_id = ee.data.getMapId({"image": best_image, **vis["visparam"]})
+    return map_id["tile_fetcher"].url_format
+
+
+def _apply_scale_factors(image):
+    opticalBands = image.select('SR_B.').multiply(0.0000275).add(-0.2)
+    return image.addBands(opticalBands, None, True)
+
+
+@lru_cache(maxsize=64)
+def _landsat_vis(visparam, collection_name):
+    """Parâmetros de visualização com min/max/gamma em texto, como o getMapId espera."""
+    vis_params = dict(get_landsat_vis_params(visparam, collection_name))
+    for key in ('min', 'max', 'gamma'):
+        if isinstance(vis_params.get(key), list):
+            vis_params[key] = ','.join(map(str, vis_params[key]))
+    return MappingProxyType(vis_params)
+
+
+@lru_cache(maxsize=1024)
+def _landsat_collection(collection_name, dt_start, dt_end, w, s, e, n):
+    """Coleção Landsat filtrada e reescalada, comum a todos os visparams."""
+    geom = ee.Geometry.BBox(w, s, e, n)
+    return ee.ImageCollection(collection_name) \
+        .filterDate(dt_start, dt_end) \
+        .filterBounds(geom) \
+        .map(_apply_scale_factors)
+
+
+def _create_landsat_layer_sync(bbox, dates, visparam, period_year):
+    """Monta o mosaico Landsat no EE e retorna o template de URL dos tiles."""
+    if 1983 <= period_year <= 1993:
+        collection_name = 'LANDSAT/LT04/C02/T1_L2'
+    elif 1984 <= period_year <= 2012:
+        collection_name = 'LANDSAT/LT05/C02/T1_L2'
+    elif 1999 <= period_year <= 2022:
+        collection_name = 'LANDSAT/LE07/C02/T1_L2'
+    elif 2013 <= period_year <= 2022:
+        collection_name = 'LANDSAT/LC08/C02/T1_L2'
+    elif period_year >= 2022:
+        collection_name = 'LANDSAT/LC09/C02/T1_L2'
+    else:
+        raise ValueError("No valid Landsat collection for the provided date range")
+
+    vis_params = _landsat_vis(visparam, collection_name)
+
+    landsat_collection = _landsat_collection(
+        collection_name, dates["dtStart"], dates["dtEnd"],
+        bbox["w"], bbox["s"], bbox["e"], bbox["n"],
+    ).select(vis_params['bands'])
+
+    landsat = landsat_collection.sort("CLOUD_COVER", False)
+    best_image = landsat.mosaic()
+
+    map_id = ee.data.getMapId({"image": best_image, **vis_params})
+    return map_id["tile_fetcher"].url_format
+
+
+# Pool exclusivo do EE: getMapId bloqueia por segundos e não pode atrasar o
+# executor padrão, onde o aiohttp resolve DNS
+_ee_pool = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS_EE, thread_name_prefix="ee")
+_ee_sem = asyncio.Semaphore(settings.MAX_WORKERS_EE * 2)
+
+
+async def _run_ee(func, *args):
+    """Executa uma chamada ao EE numa thread, limitando as que aguardam na fila."""
+    try:
+        await asyncio.wait_for(_ee_sem.acquire(), timeout=settings.EE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(429, 'Earth Engine is busy, please try again later')
+    try:
+        # copy_context: a thread herda os contextvars da requisição, como no to_thread
+        return await asyncio.get_running_loop().run_in_executor(
+            _ee_pool, contextvars.copy_context().run, func, *args
+        )
+    finally:
+        _ee_sem.release()
+
+
+def _download_error_detail(exc: Exception) -> str:
+    if isinstance(exc, HTTPException):
+        return str(exc.detail)
+    # asyncio.TimeoutError não traz mensagem
+    return str(exc) or type(exc).__name__
+
+
+async def fetch_image_from_api(session: aiohttp.ClientSession, image_url: str):
     """Busca uma imagem de uma API externa."""
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as response:
-            if response.status != 200:
-                raise HTTPException(status_code=response.status, detail="Imagem não encontrada na API externa")
-            return await response.read()
+    async with session.get(image_url) as response:
+        if response.status != 200:
+            raise HTTPException(status_code=response.status, detail="Imagem não encontrada na API externa")
+        return await response.read()
+
+_inflight: dict[str, asyncio.Task] = {}
+
+_VALKEY_ERRORS = (ValkeyConnectionError, ValkeyTimeoutError)
+
+# URLs de camada já conhecidas pelo worker, evita ir ao Valkey a cada tile novo
+_layer_urls = TTLCache(maxsize=4096, ttl=settings.LIFESPAN_URL * 3600)
+
+
+def _start_flight(key, coro_fn, *args) -> asyncio.Task:
+    """Devolve a tarefa em andamento para a chave ou cria e registra uma nova."""
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(coro_fn(*args))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return task
+
+
+async def _single_flight(key, coro_fn, *args):
+    """Executa coro_fn uma vez por chave; requisições simultâneas aguardam o mesmo resultado."""
+    task = _start_flight(key, coro_fn, *args)
+    # shield: se um cliente desconectar, o trabalho continua para os demais
+    return await asyncio.shield(task)
+
+
+async def _lookup(request, file_cache, url_cache):
+    """Busca o tile e a URL da camada, indo ao Valkey no máximo uma vez."""
+    binary_data = hot_get(file_cache)
+    layer_meta = _layer_urls.get(url_cache)
+    if binary_data is not None:
+        return binary_data, layer_meta
+
+    valkey = request.app.state.valkey
+    try:
+        if layer_meta is None:
+            binary_data, raw_meta = await valkey.mget(file_cache, url_cache)
+            layer_meta = _parse_layer_meta(raw_meta)
+            if layer_meta is not None:
+                _layer_urls[url_cache] = layer_meta
+        else:
+            binary_data = await valkey.get(file_cache)
+    except _VALKEY_ERRORS as e:
+        # Valkey lento ou pool esgotado: segue como cache miss, direto ao EE
+        _log_failure(e, '{} | {}', file_cache, e)
+        return None, layer_meta
+
+    if binary_data:
+        hot_put(file_cache, binary_data)
+    return binary_data, layer_meta
+
+
+def _parse_layer_meta(raw):
+    """Lê o {url, ts} gravado no Valkey; qualquer outro formato conta como ausente."""
+    if not raw or raw[:1] != b'{':
+        return None
+    meta = orjson.loads(raw)
+    if 'ts' not in meta:
+        return None
+    return meta
+
+
+async def _new_layer_url(request, url_cache, create_layer, *args):
+    """Gera a URL da camada no EE e a guarda no worker e no Valkey."""
+    layer_url = await _run_ee(create_layer, *args)
+    meta = {'url': layer_url, 'ts': time.time()}
+    _layer_urls[url_cache] = meta
+    _write_in_background(request.app.state.valkey.set(
+        url_cache,
+        orjson.dumps(meta),
+        ex=int(settings.LIFESPAN_URL * 3600),
+    ))
+    return layer_url
+
+
+async def _download_tile(request, layer_url, x, y, z, file_cache):
+    """Baixa o tile do EE e o guarda nos caches."""
+    binary_data = await fetch_image_from_api(
+        request.app.state.http, _url_template(layer_url) % {'x': x, 'y': y, 'z': z}
+    )
+    hot_put(file_cache, binary_data)
+    _write_in_background(request.app.state.valkey.set(file_cache, binary_data))
+    return binary_data
+
 
 @router.get("/s2_harmonized/{x}/{y}/{z}")
 async def get_s2_harmonized(
@@ -42,105 +466,85 @@ async def get_s2_harmonized(
     y: int,
     z: int,
     period: Period = Period.WET,
-    year: int = datetime.now().year,
+    year: Optional[int] = None,
     visparam="tvi-red",
-    month: int = int(datetime.now().month),
-    
+    month: Optional[int] = None,
 ):
-    logger.info(f'period {period}, year {year}, month {month}')
-    metadata = list(filter(lambda x: x['name'] == 's2_harmonized', CAPABILITIES['collections']))[0]
-    
-    if not year in metadata['year']:
-        raise HTTPException(404,f'Invalid year, please try valid year {metadata["year"]}')
-    if not period in metadata['period']:
-        raise HTTPException(404,f'Invalid period, please try valid period {metadata["period"]}')
-    if not visparam in metadata['visparam']:
-        raise HTTPException(404,f'Invalid visparam, please try valid visparam {metadata["visparam"]}')
-
-    PERIODS = {
-        "WET": {"name": "WET", "dtStart": f"{year}-01-01", "dtEnd": f"{year}-04-30"},
-        "DRY": {"name": "DRY", "dtStart": f"{year}-06-01", "dtEnd": f"{year}-10-30"},
-    }
-
-    if period == "MONTH":
-        if month < 1 or month > 12:
-            raise HTTPException(400, 'Invalid month, please provide a month between 1 and 12')
-        _, last_day = calendar.monthrange(year, month)
-        PERIODS["MONTH"] = {
-            "name": "MONTH",
-            "dtStart": f"{year}-{month:02}-01",
-            "dtEnd": f"{year}-{month:02}-{last_day:02}"
-        }
-
-    if not (9 < z < 19):
+    if year is None or month is None:
+        now = datetime.now()
+        year = now.year if year is None else year
+        month = now.month if month is None else month
+    logger.info('period {}, year {}, month {}', period, year, month)
+    ok, detail = _check_capability('s2_harmonized', year, period, visparam)
+    if not ok:
+        raise HTTPException(404, detail)
+
+    if period == "MONTH" and (month < 1 or month > 12):
+        raise HTTPException(400, 'Invalid month, please provide a month between 1 and 12')
+
+    if not zoom_in_range(z):
         logger.debug('zoom ')
-        return FileResponse('data/maxminzoom.png', media_type="image/png")
+        return _static_png(MAXMIN_ZOOM_PNG)
 
-    period_select = PERIODS.get(period, "Error")
-    if period_select == "Error":
+    if settings.BRAZIL_ONLY and not is_within_brazil(x, y, z):
+        return _static_png(_BLANK_PNG)
+
+    period_select = _build_periods(period.value, year, month)
+    if period_select is None:
         raise HTTPException(
             status_code=404,
-            detail=f"period not found, please try valid period {list(PERIODS.keys())}",
+            detail=f"period not found, please try valid period {[p.value for p in Period]}",
         )
 
-    _visparam = VISPARAMS.get(visparam, "Error")
-    if _visparam == "Error":
+    _visparam = _vis_param(visparam)
+    if _visparam is None:
         raise HTTPException(
             status_code=404,
             detail=f"visparam not found, please try valid vis parameter {list(VISPARAMS.keys())}",
         )
 
-    logger.info(f'period {period}, year {year}, month {month}, period_select {period_select}')
+    logger.info(
+        'period {}, year {}, month {}, period_select {}', period, year, month, period_select
+    )
     _geohash, bbox = tile2goehashBBOX(x, y, z)
     path_cache = f's2_harmonized_{period_select["name"]}_{year}_{visparam}/{_geohash}'
 
     file_cache = f"{path_cache}/{z}/{x}_{y}.png"
+    url_cache = layer_url_key('s2_harmonized', period_select, visparam, _geohash)
+
+    binary_data, urlGEElayer = await _lookup(request, file_cache, url_cache)
 
-    binary_data = request.app.state.valkey.get(file_cache)
-    
     if binary_data:
         # logger.info(f"Using cached file: {file_cache}")
-        return StreamingResponse(io.BytesIO(binary_data), media_type="image/png")
-
-    urlGEElayer = getCacheUrl(request.app.state.valkey.get(path_cache))
+        return await _serve_tile(request, file_cache, binary_data)
 
     if (urlGEElayer is None
-        or (datetime.now() - urlGEElayer['date']).total_seconds() / 3600
-        > settings.LIFESPAN_URL
-        
+        or time.time() - urlGEElayer['ts'] > settings.LIFESPAN_URL * 3600
     ):
         try:
-            logger.debug(f"New url: {path_cache}")
-            geom = ee.Geometry.BBox(bbox["w"], bbox["s"], bbox["e"], bbox["n"])
-            s2 = ee.ImageCollection("COPERNICUS/S2_HARMONIZED")
-            s2 = s2.filterDate(
-                period_select["dtStart"], period_select["dtEnd"]
-            ).filterBounds(geom)
-            s2 = s2.sort("CLOUDY_PIXEL_PERCENTAGE", False)
-            s2 = s2.select(*_visparam["select"])
-            best_image = s2.mosaic()
-            
-            logger.debug(f'{_visparam["select"]} | {_visparam["visparam"]}')
-            
-            map_id = ee.data.getMapId({"image": best_image, **_visparam["visparam"]})
-            layer_url = map_id["tile_fetcher"].url_format
-            request.app.state.valkey.set(path_cache,f'{layer_url}, {datetime.now()}')
+            logger.debug("New url: {}", path_cache)
+            layer_url = await _single_flight(
+                url_cache, _new_layer_url, request, url_cache,
+                _create_s2_layer_sync, bbox, period_select, _visparam,
+            )
         except Exception as e:
-            logger.exception(f'{file_cache} | {e}')
-            return FileResponse('data/blank.png', media_type="image/png")
+            _log_failure(e, '{} | {}', file_cache, e)
+            # Falha transitória do EE: o cliente não deve guardar o tile vazio
+            return _static_png(_BLANK_PNG, cache_control="no-store")
             
     else:
         logger.debug("Using existing layer URL")
         layer_url = urlGEElayer['url']
 
     try:
-        binary_data = await fetch_image_from_api(layer_url.format(x=x, y=y,z=z))
-        request.app.state.valkey.set(file_cache, binary_data)
-    except HTTPException as exc:
-        logger.exception(f'{file_cache} {exc}')
-        raise HTTPException(500, exc)
-    logger.info(f"Success not cached {file_cache}")
-    return StreamingResponse(io.BytesIO(binary_data), media_type="image/png")
+        binary_data = await _single_flight(
+            file_cache, _download_tile, request, layer_url, x, y, z, file_cache
+        )
+    except (HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        _log_failure(exc, '{} {}', file_cache, exc)
+        raise HTTPException(500, _download_error_detail(exc))
+    logger.info("Success not cached {}", file_cache)
+    return await _serve_tile(request, file_cache, binary_data, fresh=True)
 
 @router.get("/landsat/{x}/{y}/{z}")
 async def get_landsat(
@@ -149,132 +553,79 @@ async def get_landsat(
         y: int,
         z: int,
         period: str = "MONTH",
-        year: int = int(datetime.now().year),
+        year: Optional[int] = None,
         visparam: str = "landsat-tvi-false",
-        month: int = int(datetime.now().month),
+        month: Optional[int] = None,
 ):
-    logger.info(f'period {period}, year {year}, month {month}')
-    metadata = next(filter(lambda x: x['name'] == 'landsat', CAPABILITIES['collections']), None)
-    if not metadata:
-        raise HTTPException(404, 'Landsat capabilities not found.')
-
-    if year not in metadata['year']:
-        logger.debug(f'Invalid year, please try a valid year: {metadata["year"]}')
-        return FileResponse('data/notfound.png', media_type="image/png")
-    if period not in metadata['period']:
-        logger.debug(f'Invalid period, please try a valid period: {metadata["period"]}')
-        return FileResponse('data/notfound.png', media_type="image/png")
-    if visparam not in metadata['visparam']:
-        logger.debug(f'Invalid visparam, please try a valid visparam: {metadata["visparam"]}')
-        return FileResponse('data/notfound.png', media_type="image/png")
-
-    PERIODS = {
-        "WET": {"name": "WET", "dtStart": f"{year}-01-01", "dtEnd": f"{year}-04-30"},
-        "DRY": {"name": "DRY", "dtStart": f"{year}-06-01", "dtEnd": f"{year}-10-30"},
-    }
-
-    if period == "MONTH":
-        if month < 1 or month > 12:
-            logger.debug('Invalid month, please provide a month between 1 and 12')
-            return FileResponse('data/notfound.png', media_type="image/png")
-
-        _, last_day = calendar.monthrange(year, month)
-        PERIODS["MONTH"] = {
-            "name": "MONTH",
-            "dtStart": f"{year}-{month:02}-01",
-            "dtEnd": f"{year}-{month:02}-{last_day:02}"
-        }
-
-    if not (9 < z < 19):
+    if year is None or month is None:
+        now = datetime.now()
+        year = now.year if year is None else year
+        month = now.month if month is None else month
+    logger.info('period {}, year {}, month {}', period, year, month)
+    ok, detail = _check_capability('landsat', year, period, visparam)
+    if not ok:
+        logger.debug(detail)
+        return _static_png(_NOTFOUND_PNG)
+
+    if period == "MONTH" and (month < 1 or month > 12):
+        logger.debug('Invalid month, please provide a month between 1 and 12')
+        return _static_png(_NOTFOUND_PNG)
+
+    if not zoom_in_range(z):
         logger.debug('Invalid zoom level')
-        return FileResponse('data/maxminzoom.png', media_type="image/png")
+        return _static_png(MAXMIN_ZOOM_PNG)
+
+    if settings.BRAZIL_ONLY and not is_within_brazil(x, y, z):
+        return _static_png(_BLANK_PNG)
 
-    period_select = PERIODS.get(period)
+    period_select = _build_periods(period, year, month)
     if not period_select:
-        logger.debug(f"Period not found, please try a valid period: {list(PERIODS.keys())}")
-        return FileResponse('data/notfound.png', media_type="image/png")
+        logger.opt(lazy=True).debug(
+            "Period not found, please try a valid period: {}", lambda: [p.value for p in Period]
+        )
+        return _static_png(_NOTFOUND_PNG)
 
-    vis_type = VISPARAMS.get(visparam)
+    vis_type = _vis_param(visparam)
     if not vis_type:
-        logger.debug(f"Visparam not found, please try a valid visparam: {list(VISPARAMS.keys())}")
-        return FileResponse('data/notfound.png', media_type="image/png")
+        logger.opt(lazy=True).debug(
+            "Visparam not found, please try a valid visparam: {}", lambda: list(VISPARAMS.keys())
+        )
+        return _static_png(_NOTFOUND_PNG)
 
     _geohash, bbox = tile2goehashBBOX(x, y, z)
 
     path_cache = f'landsat_{period_select["name"]}_{year}_{month}_{visparam}/{_geohash}'
 
     file_cache = f"{path_cache}/{z}/{x}_{y}.png"
-    logger.info(file_cache)
-    binary_data = request.app.state.valkey.get(file_cache)
+    url_cache = layer_url_key('landsat', period_select, visparam, _geohash)
+    logger.info('{}', file_cache)
+    binary_data, urlGEElayer = await _lookup(request, file_cache, url_cache)
 
     if binary_data:
         # logger.info(f"Using cached file: {file_cache}")
-        return StreamingResponse(io.BytesIO(binary_data), media_type="image/png")
+        return await _serve_tile(request, file_cache, binary_data)
 
-    urlGEElayer_json = request.app.state.valkey.get(path_cache)
-
-    if urlGEElayer_json is None or (datetime.now() - datetime.fromisoformat(
-            json.loads(urlGEElayer_json)['date'])).total_seconds() / 3600 > settings.LIFESPAN_URL:
+    if urlGEElayer is None or time.time() - urlGEElayer['ts'] > settings.LIFESPAN_URL * 3600:
         try:
-            logger.debug(f"New url: {path_cache}")
-            geom = ee.Geometry.BBox(bbox["w"], bbox["s"], bbox["e"], bbox["n"])
-
-            period_year = datetime.strptime(period_select["dtStart"], "%Y-%m-%d").year
-            if 1983 <= period_year <= 1993:
-                collection_name = 'LANDSAT/LT04/C02/T1_L2'
-            elif 1984 <= period_year <= 2012:
-                collection_name = 'LANDSAT/LT05/C02/T1_L2'
-            elif 1999 <= period_year <= 2022:
-                collection_name = 'LANDSAT/LE07/C02/T1_L2'
-            elif 2013 <= period_year <= 2022:
-                collection_name = 'LANDSAT/LC08/C02/T1_L2'
-            elif period_year >= 2022:
-                collection_name = 'LANDSAT/LC09/C02/T1_L2'
-            else:
-                raise ValueError("No valid Landsat collection for the provided date range")
-
-            vis_params = get_landsat_vis_params(visparam, collection_name)
-
-            if isinstance(vis_params.get('min'), list):
-                vis_params['min'] = ','.join(map(str, vis_params['min']))
-            if isinstance(vis_params.get('max'), list):
-                vis_params['max'] = ','.join(map(str, vis_params['max']))
-            if isinstance(vis_params.get('gamma'), list):
-                vis_params['gamma'] = ','.join(map(str, vis_params['gamma']))
-
-            def apply_scale_factors(image):
-                opticalBands = image.select('SR_B.').multiply(0.0000275).add(-0.2)
-                return image.addBands(opticalBands, None, True)
-
-            landsat_collection = ee.ImageCollection(collection_name) \
-                .filterDate(period_select["dtStart"], period_select["dtEnd"]) \
-                .filterBounds(geom) \
-                .map(apply_scale_factors) \
-                .select(vis_params['bands'])
-
-            landsat = landsat_collection.sort("CLOUD_COVER", False)
-            best_image = landsat.mosaic()
-
-            map_id = ee.data.getMapId({"image": best_image, **vis_params})
-
-            layer_url = map_id["tile_fetcher"].url_format
-            request.app.state.valkey.set(path_cache, json.dumps({'url': layer_url, 'date': datetime.now().isoformat()}))
-
+            logger.debug("New url: {}", path_cache)
+            layer_url = await _single_flight(
+                url_cache, _new_layer_url, request, url_cache,
+                _create_landsat_layer_sync, bbox, period_select, visparam, year,
+            )
         except Exception as e:
-            logger.exception(f'{file_cache} | {e}')
-            error_image = generate_error_image(f"Error: {str(e)}")
-            return StreamingResponse(error_image, media_type="image/png")
+            _log_failure(e, '{} | {}', file_cache, e)
+            return _error_response(f"Error: {str(e)}")
     else:
-        layer_url = json.loads(urlGEElayer_json)['url']
+        layer_url = urlGEElayer['url']
 
     try:
-        binary_data = await fetch_image_from_api(layer_url.format(x=x, y=y, z=z))
-        request.app.state.valkey.set(file_cache, binary_data)
-    except HTTPException as exc:
-        logger.exception(f'{file_cache} | {exc}')
-        error_image = generate_error_image(f"Error: {str(e)}")
-        return StreamingResponse(error_image, media_type="image/png")
-
-    logger.info(f"Success not cached {file_cache}")
-    return StreamingResponse(io.BytesIO(binary_data), media_type="image/png")
+        binary_data = await _single_flight(
+            file_cache, _download_tile, request, layer_url, x, y, z, file_cache
+        )
+    except (HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as exc:
+        _log_failure(exc, '{} | {}', file_cache, exc)
+        return _error_response(f"Error: {_download_error_detail(exc)}")
+
+    logger.info("Success not cached {}", file_cache)
+    return await _serve_tile(request, file_cache, binary_data, fresh=True)
 
@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 from scipy.signal import savgol_filter
@@ -9,6 +10,46 @@ from fastapi.responses import JSONResponse
 router = APIRouter()
 
 
+def _mask_landsat(image):
+    qa = image.select('QA_PIXEL')
+    cloud = qa.bitwiseAnd(1 << 5).eq(0)
+    cloud_shadow = qa.bitwiseAnd(1 << 3).eq(0)
+    return image.updateMask(cloud).updateMask(cloud_shadow)
+
+
+def _calculate_ndvi(image):
+    ndvi = image.normalizedDifference(['NIR', 'RED']).rename('NDVI')
+    return image.addBands(ndvi)
+
+
+# Function to mask clouds using the QA60 band
+def _mask_s2_clouds(image):
+    qa = image.select('QA60')
+    cloudBitMask = 1 << 10
+    cirrusBitMask = 1 << 11
+    mask = qa.bitwiseAnd(cloudBitMask).eq(0).And(qa.bitwiseAnd(cirrusBitMask).eq(0))
+    return image.updateMask(mask)
+
+
+# Function to calculate and add an NDVI band
+def _add_s2_ndvi(image):
+    ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
+    return image.addBands(ndvi)
+
+
+@lru_cache(maxsize=1)
+def _landsat_merged():
+    """Coleção Landsat 4-9 harmonizada (RED/NIR) e mascarada, montada uma única vez."""
+    bands_tm = (['SR_B3', 'SR_B4', 'QA_PIXEL'], ['RED', 'NIR', 'QA_PIXEL'])
+    bands_oli = (['SR_B4', 'SR_B5', 'QA_PIXEL'], ['RED', 'NIR', 'QA_PIXEL'])
+    l4 = ee.ImageCollection('LANDSAT/LT04/C02/T1_L2').select(*bands_tm).map(_mask_landsat)
+    l5 = ee.ImageCollection('LANDSAT/LT05/C02/T1_L2').select(*bands_tm).map(_mask_landsat)
+    l7 = ee.ImageCollection('LANDSAT/LE07/C02/T1_L2').select(*bands_tm).map(_mask_landsat)
+    l8 = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2').select(*bands_oli).map(_mask_landsat)
+    l9 = ee.ImageCollection('LANDSAT/LC09/C02/T1_L2').select(*bands_oli).map(_mask_landsat)
+    return l4.merge(l5).merge(l7).merge(l8).merge(l9)
+
+
 @router.get("/landsat/{lat}/{lon}")
 def timeseries_landsat(
         lat: float,
@@ -24,44 +65,8 @@ def timeseries_landsat(
 
         point = ee.Geometry.Point([lon, lat])
 
-        def mask(image):
-            qa = image.select('QA_PIXEL')
-            cloud = qa.bitwiseAnd(1 << 5).eq(0)
-            cloud_shadow = qa.bitwiseAnd(1 << 3).eq(0)
-            return image.updateMask(cloud).updateMask(cloud_shadow)
-
-        def calculate_ndvi(image):
-            ndvi = image.normalizedDifference(['NIR', 'RED']).rename('NDVI')
-            return image.addBands(ndvi)
-
-        l4 = ee.ImageCollection('LANDSAT/LT04/C02/T1_L2').select(['SR_B3', 'SR_B4', 'QA_PIXEL'],
-                                                                 ['RED', 'NIR', 'QA_PIXEL']).map(mask)
-        l5 = ee.ImageCollection('LANDSAT/LT05/C02/T1_L2').select(['SR_B3', 'SR_B4', 'QA_PIXEL'],
-                                                                 ['RED', 'NIR', 'QA_PIXEL']).map(mask)
-        l7 = ee.ImageCollection('LANDSAT/LE07/C02/T1_L2').select(['SR_B3', 'SR_B4', 'QA_PIXEL'],
-                                                                 ['RED', 'NIR', 'QA_PIXEL']).map(mask)
-        l8 = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2').select(['SR_B4', 'SR_B5', 'QA_PIXEL'],
-                                                                 ['RED', 'NIR', 'QA_PIXEL']).map(mask)
-        l9 = ee.ImageCollection('LANDSAT/LC09/C02/T1_L2').select(['SR_B4', 'SR_B5', 'QA_PIXEL'],
-                                                                 ['RED', 'NIR', 'QA_PIXEL']).map(mask)
-
-        collections = l4.merge(l5).merge(l7).merge(l8).merge(l9).filterBounds(point).filterDate(data_inicio,
-                                                                                                data_fim).map(
-            calculate_ndvi)
-
-        def select_best_quality_image(collection):
-            distinct_dates = collection.aggregate_array('system:time_start').distinct()
-
-            def map_dates(date):
-                date = ee.Date(date)
-                date_collection = collection.filterDate(date, date.advance(1, 'day'))
-                return ee.Algorithms.If(date_collection.size(), date_collection.qualityMosaic('QA_PIXEL'), None)
-
-            best_images = distinct_dates.map(map_dates)
-            best_images = ee.ImageCollection(best_images).filter(ee.Filter.notNull(['system:time_start']))
-            return best_images
-
-        best_quality_collections = collections
+        best_quality_collections = _landsat_merged().filterBounds(point).filterDate(
+            data_inicio, data_fim).map(_calculate_ndvi)
 
         def get_ndvi_time_series(image):
             date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd')
@@ -278,26 +283,13 @@ def timeseries_sentinel2(
 
         point = ee.Geometry.Point([lon, lat])
 
-        # Function to mask clouds using the QA60 band
-        def maskS2clouds(image):
-            qa = image.select('QA60')
-            cloudBitMask = 1 << 10
-            cirrusBitMask = 1 << 11
-            mask = qa.bitwiseAnd(cloudBitMask).eq(0).And(qa.bitwiseAnd(cirrusBitMask).eq(0))
-            return image.updateMask(mask)
-
-        # Function to calculate and add an NDVI band
-        def addNDVI(image):
-            ndvi = image.normalizedDifference(['B8', 'B4']).rename('NDVI')
-            return image.addBands(ndvi)
-
         # Load Sentinel-2 image collection
         s2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
             .filterDate(data_inicio, data_fim) \
             .filterBounds(point) \
             .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)) \
-            .map(maskS2clouds) \
-            .map(addNDVI) \
+            .map(_mask_s2_clouds) \
+            .map(_add_s2_ndvi) \
             .filter(ee.Filter.notNull(['system:time_start']))
 
         # Create a time series of NDVI values
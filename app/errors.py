@@ -1,4 +1,5 @@
 import io
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 def generate_error_image(error_message: str) -> io.BytesIO:
     # Load the provided image
@@ -21,4 +22,10 @@ def generate_error_image(error_message: str) -> io.BytesIO:
     img_byte_arr = io.BytesIO()
     image.save(img_byte_arr, format='PNG')
     img_byte_arr.seek(0)
-    return img_byte_arr
\ No newline at end of file
+    return img_byte_arr
+
+
+@lru_cache(maxsize=256)
+def error_image_bytes(error_message: str) -> bytes:
+    # The set of error messages is small, so render each one only once
+    return generate_error_image(error_message).getvalue()
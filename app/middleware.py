@@ -0,0 +1,26 @@
+import re
+
+from app.tile import MAXMIN_ZOOM_PNG, zoom_in_range
+
+_TILE_PATH = re.compile(r"^/api/layers/(?:s2_harmonized|landsat)/\d+/\d+/(\d+)$")
+_MAXMIN_HEADERS = [
+    (b"content-type", b"image/png"),
+    (b"content-length", str(len(MAXMIN_ZOOM_PNG)).encode()),
+    (b"cache-control", b"public, max-age=86400"),
+]
+
+
+class TileGuardMiddleware:
+    """Responde tiles fora da faixa de zoom antes do roteamento do FastAPI."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            match = _TILE_PATH.match(scope["path"])
+            if match and not zoom_in_range(int(match.group(1))):
+                await send({"type": "http.response.start", "status": 200, "headers": _MAXMIN_HEADERS})
+                await send({"type": "http.response.body", "body": MAXMIN_ZOOM_PNG})
+                return
+        await self.app(scope, receive, send)
@@ -1,9 +1,20 @@
 import math
+from functools import lru_cache
+from pathlib import Path
 
 import geohash
 import geopandas as gpd
 from shapely.geometry import Point
 
+# Faixa de zoom servida pelas camadas; fora dela responde-se MAXMIN_ZOOM_PNG
+MIN_ZOOM = 10
+MAX_ZOOM = 18
+MAXMIN_ZOOM_PNG = Path("data/maxminzoom.png").read_bytes()
+
+
+def zoom_in_range(zoom):
+    return MIN_ZOOM <= zoom <= MAX_ZOOM
+
 
 def latlon_to_tile(lat, lon, zoom):
     """Converts latitude and longitude to tile coordinates."""
@@ -14,6 +25,7 @@ def latlon_to_tile(lat, lon, zoom):
     return x_tile, y_tile
 
 
+@lru_cache(maxsize=32)
 def get_brazil_tile_bounds(zoom):
     """Returns the tile boundaries for Brazil at a specific zoom level."""
     # Aproximated boundaries for Brazil
@@ -60,6 +72,7 @@ def is_within_boundsbox(lat, lon, x, y, z):
     return x in range(x_min, x_max + 1) and y in range(y_max, y_min + 1)
 
 
+@lru_cache(maxsize=4096)
 def tile2goehashBBOX(x_tile, y_tile, zoom):
     """Converts tile coordinates to latitude and longitude."""
     n = 2.0**zoom
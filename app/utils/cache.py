@@ -1,9 +1,25 @@
-from datetime import datetime
-from app.config import logger
+import hashlib
 
+from cachetools import LRUCache
 
-def getCacheUrl(cache):
-    if cache is None:
-        return None
-    url, date = cache.decode('utf8').split(', ')
-    return {'url':url, 'date':datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')}
\ No newline at end of file
+from app.config import logger, settings
+
+# Tiles mais recentes do worker (PNG e WebP), na frente do Valkey. Limitado
+# em bytes, não em quantidade. Só é acessado pelo event loop, então não
+# precisa de lock.
+_hot_tiles = LRUCache(maxsize=settings.HOT_CACHE_MB * 1024 * 1024, getsizeof=len)
+
+
+def layer_url_key(layer, dates, visparam, geohash):
+    """Chave da URL do EE, compartilhada por todos os tiles com as mesmas datas."""
+    raw = f"{layer}|{dates['dtStart']}|{dates['dtEnd']}|{visparam}|{geohash}"
+    return f"ee_url/{hashlib.blake2b(raw.encode()).hexdigest()[:32]}"
+
+
+def hot_get(key):
+    return _hot_tiles.get(key)
+
+
+def hot_put(key, value):
+    if len(value) <= _hot_tiles.maxsize:
+        _hot_tiles[key] = value
@@ -1,15 +1,18 @@
 import typing
+from contextlib import asynccontextmanager
 
 from app.utils.capabilities import CAPABILITIES
+import aiohttp
 import ee
 import orjson
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 from google.oauth2 import service_account
-import valkey
+import valkey.asyncio as valkey
 
 from app.config import settings, logger, start_logger
 from app.database import Base, engine
+from app.middleware import TileGuardMiddleware
 from app.router import created_routes
 
 Base.metadata.create_all(bind=engine)
@@ -20,10 +23,8 @@ class ORJSONResponse(JSONResponse):
     def render(self, content: typing.Any) -> bytes:
         return orjson.dumps(content)
 
-app = FastAPI(default_response_class=ORJSONResponse)
-
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     start_logger()
     try:
         service_account_file = settings.GEE_SERVICE_ACCOUNT_FILE
@@ -38,11 +39,37 @@ async def startup_event():
     except Exception as e:
         raise HTTPException(status_code=500, detail="Failed to initialize GEE")
     
-    app.state.valkey = valkey.Valkey(host='valkey', port=6379)
-    
-@app.on_event("shutdown")
-async def shutdown_event():
-    app.state.valkey.close()
+    pool = valkey.BlockingConnectionPool(
+        host=settings.VALKEY_HOST,
+        port=settings.VALKEY_PORT,
+        max_connections=settings.VALKEY_MAX_CONNECTIONS,
+        timeout=settings.VALKEY_TIMEOUT,
+        socket_timeout=settings.VALKEY_TIMEOUT,
+        socket_connect_timeout=settings.VALKEY_TIMEOUT,
+        health_check_interval=30,
+    )
+    app.state.valkey = valkey.Valkey(connection_pool=pool)
+    app.state.http = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=512,
+            limit_per_host=128,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True,
+        ),
+        timeout=aiohttp.ClientTimeout(total=15),
+        # Um tile inteiro cabe no buffer, sem pausar a leitura do socket
+        read_bufsize=1024 * 1024,
+    )
+
+    yield
+
+    await app.state.http.close()
+    await app.state.valkey.aclose(close_connection_pool=True)
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(TileGuardMiddleware)
 
 @app.get("/")
 def read_root():